@@ -7,19 +7,117 @@ Author:  Giuseppe Calabrese
 Copying: Public Domain
 """
 
-from secrets import randbelow  # Our default CSPRNG.
-from math import log2
-from re import fullmatch, findall
+from secrets import randbelow, token_bytes  # Our default CSPRNG.
+from array import array
+from bisect import bisect_right
+from codecs import getincrementaldecoder
+from collections import deque
+from collections.abc import Sequence, Sized
+from functools import lru_cache
+from itertools import accumulate, islice
+from math import exp, floor, lgamma, log, log1p
+from mmap import ACCESS_READ, mmap
+import os
+from string import ascii_lowercase, ascii_uppercase, digits, punctuation
+from weakref import WeakSet
 
 __version__ = "0.5.0"
 
 
+class RandPool:
+    """
+    A pool of cryptographically secure random bytes.
+
+    Bytes are fetched from `secrets.token_bytes` a batch at a time and
+    served from memory, so that drawing many random integers costs few
+    calls into the system's CSPRNG.
+
+    A pool is itself a random integer generator, which can be passed
+    wherever a `randbelow` function is expected.
+
+    No byte is ever served twice, not even across `os.fork()`: a forked
+    child empties the pools it inherited instead of serving their bytes
+    again.
+    """
+
+    def __init__(self, size=4096):
+        self._size = size
+        self._clear()
+        _pools.add(self)
+
+    def _clear(self):
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def _take(self, k):
+        """
+        Take `k` random bytes from the pool, as an unsigned integer.
+        """
+        if self._pos + k > len(self._buffer):
+            self._buffer = bytearray(token_bytes(max(self._size, k)))
+            self._pos = 0
+        chunk = self._buffer[self._pos : self._pos + k]
+        self._pos += k
+        return int.from_bytes(chunk, "little")
+
+    def bounded(self, n):
+        """
+        Draw a random integer in the range [0, `n`).
+
+        A drop-in replacement for `secrets.randbelow`.
+
+        Use Lemire's multiply-and-shift method, rejecting the few draws
+        that would bias the result.
+        """
+        if n <= 0:
+            raise ValueError("upper bound must be positive")
+        if n & (n - 1) == 0:
+            # A power of two: just take as many bits as needed.
+            return self._take((n.bit_length() + 6) // 8) & (n - 1)
+        if n > 1 << 64:
+            return randbelow(n)
+
+        bits = 32 if n <= 1 << 32 else 64
+        mask = (1 << bits) - 1
+        m = self._take(bits // 8) * n
+        if m & mask < n:
+            threshold = (1 << bits) % n
+            while m & mask < threshold:
+                m = self._take(bits // 8) * n
+        return m >> bits
+
+    __call__ = bounded
+
+
+# The live pools, to be emptied in forked children.
+_pools = WeakSet()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: [p._clear() for p in _pools])
+
+
+def uniform(randbelow=randbelow):
+    """
+    Draw a random float in the open interval (0, 1).
+
+    Take:
+        randbelow   a random integer generator (default: secrets.randbelow)
+
+    The result is one of 2**52 evenly spaced values, drawn with a single
+    power-of-two bound (which a `RandPool` serves without rejection).
+    """
+    return (randbelow(2**52) + 0.5) / 2**52
+
+
 def select(source, n, randbelow=randbelow):
     """
     Randomly select, on-line, from an iterable of unknown length.
 
     "On-line" means that the iterable is not enumerated upfront;
-    rather, the selection is drawn during iteration.
+    rather, the selection is drawn during iteration. Elements that would
+    not enter the selection are skipped over in bulk (Li's Algorithm L),
+    so the number of random draws grows only logarithmically with the
+    length of `source`.
 
     Take:
         source      a (finite) iterable that provides the elements
@@ -28,6 +126,8 @@ def select(source, n, randbelow=randbelow):
 
     The `randbelow` argument must be a function that accepts a positive
     integer `n` and returns a random integer in the range [0, `n`).
+    A `RandPool` will do, and makes for far fewer calls into the system's
+    CSPRNG.
 
     Return the selection (as a list) and the number of iterated elements.
     """
@@ -40,24 +140,74 @@ def select(source, n, randbelow=randbelow):
 
     # Provisional selection.
     try:
-        head = [next(source) for _ in range(n)]
+        selection = [next(source) for _ in range(n)]
     except StopIteration:
         raise RuntimeError("source was too short")
-    selection = [head.pop(randbelow(len(head))) for _ in range(n)]
 
-    # Maintain a random selection as we go over the source.
-    i = n - 1
-    for i, el in enumerate(source, n):
-        r = randbelow(i)
-        if r < n:
-            selection[r] = el
+    # Shuffle it in place, so that the order of the selection is random too.
+    for j in range(n - 1, 0, -1):
+        r = randbelow(j + 1)
+        selection[j], selection[r] = selection[r], selection[j]
+
+    # Maintain a random selection as we go over the source, jumping
+    # straight to the elements that enter it (Li's Algorithm L).
+    counted = enumerate(source, n + 1)
+    space = n
+    w = exp(log(uniform(randbelow)) / n)
+    while True:
+        skip = floor(log(uniform(randbelow)) / log1p(-w)) if w < 1 else 0
+        target = space + skip + 1
+        # Pass over the skipped elements, landing on the next one (if any).
+        for space, el in deque(islice(counted, skip + 1), maxlen=1):
+            pass
+        if space < target:
+            break
+        selection[randbelow(n)] = el
+        w *= exp(log(uniform(randbelow)) / n)
+
+    return selection, space
+
+
+def _floyd(n, size, randbelow):
+    """
+    Draw `n` distinct positions in the range [0, `size`), in random order.
+    """
+    if n < 0:
+        raise ValueError("selection size must be non-negative")
+    if size < n:
+        raise RuntimeError("source was too short")
+
+    # Floyd's algorithm, in its variant yielding a random permutation.
+    positions = []
+    for j in range(size - n, size):
+        t = randbelow(j + 1)
+        if t in positions:
+            positions.insert(positions.index(t) + 1, j)
+        else:
+            positions.insert(0, t)
+    return positions
+
 
-    return selection, i + 1
+def sample(population, n, randbelow=randbelow):
+    """
+    Randomly select from a sequence.
+
+    Take:
+        population  a sequence that provides the elements
+        n           the number of elements to select
+        randbelow   a random integer generator (default: secrets.randbelow)
+
+    Only the selected elements are accessed.
+
+    Return the selection (as a list) and the length of `population`.
+    """
+    size = len(population)
+    return [population[i] for i in _floyd(n, size, randbelow)], size
 
 
 def dictionary(path, encoding=None):
     """
-    Create an iterator from a dictionary file.
+    Open a dictionary file.
 
     Take:
         path     the path of a dictionary file, listing a set of
@@ -66,43 +216,228 @@ def dictionary(path, encoding=None):
                  means that the encoding depends on the current
                  locale
 
-    A generator yielding each line of the dictionary file, with
+    Map the file in memory if possible (see `mmap_dictionary()`);
+    otherwise (e.g. if it is a pipe) read it whole.
+
+    A file that does not decode raises UnicodeDecodeError, naming the
+    offending line; a mapped file does so as soon as its length is
+    taken.
+
+    Return a sequence of the lines of the dictionary file, with
     whitespace strip()ed.
     """
-    with open(path, "rt", encoding=encoding) as f:
-        for line in f:
-            yield line.strip()
+    try:
+        return mmap_dictionary(path, encoding)
+    except (OSError, ValueError):
+        return _read_dictionary(path, encoding)
+
+
+def _read_dictionary(path, encoding):
+    if encoding is None:
+        from locale import getpreferredencoding
+
+        encoding = getpreferredencoding(False)
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        words = data.decode(encoding).split("\n")
+    except UnicodeDecodeError as e:
+        raise _locate(e, data, e.start) from None
+    if not words[-1]:
+        words.pop()
+    return [w.strip() for w in words]
+
+
+def _locate(e, data, start):
+    """
+    Relocate a decoding error at offset `start` of a dictionary file.
+
+    Return an equivalent UnicodeDecodeError, positioned within the whole
+    file, whose reason names the offending line.
+    """
+    line = data[:start].count(b"\n") + 1
+    return UnicodeDecodeError(
+        e.encoding,
+        bytes(data),
+        start,
+        start + e.end - e.start,
+        "%s (line %d)" % (e.reason, line),
+    )
+
+
+class MappedDictionary(Sequence):
+    """
+    A memory-mapped dictionary file.
+
+    The file is scanned the first time its length is needed, counting
+    newlines block by block and checking that it decodes; locating a
+    line then only takes a search within its block, and only accessed
+    words are kept decoded.
+    """
+
+    _BLOCK = 1 << 12
+
+    def __init__(self, path, encoding=None):
+        if encoding is None:
+            from locale import getpreferredencoding
+
+            encoding = getpreferredencoding(False)
+        self._encoding = encoding
+        if "\n".encode(self._encoding) != b"\n":
+            raise ValueError("unsupported encoding: %s" % self._encoding)
+
+        with open(path, "rb") as f:
+            self._map = mmap(f.fileno(), 0, access=ACCESS_READ)
+        self._counts = None
+
+    def _index(self):
+        # The number of newlines preceding each block.
+        if self._counts is None:
+            data, block = self._map, self._BLOCK
+            decoder = getincrementaldecoder(self._encoding)()
+            counts = array("q", [0])
+            for start in range(0, len(data), block):
+                chunk = data[start : start + block]
+                pending = len(decoder.getstate()[0])
+                try:
+                    decoder.decode(chunk, start + block >= len(data))
+                except UnicodeDecodeError as e:
+                    raise _locate(e, data, start - pending + e.start) from None
+                counts.append(counts[-1] + chunk.count(b"\n"))
+            self._counts = counts
+        return self._counts
+
+    def __len__(self):
+        return self._index()[-1] + (self._map[-1:] != b"\n")
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        i = range(len(self))[i]
+
+        # Find the newline ending the previous line, within its block.
+        start = 0
+        if i:
+            b = bisect_right(self._index(), i - 1) - 1
+            start = b * self._BLOCK - 1
+            for _ in range(i - self._counts[b]):
+                start = self._map.find(b"\n", start + 1)
+            start += 1
+
+        end = self._map.find(b"\n", start)
+        return self._decode(start, end if end != -1 else len(self._map))
+
+    def __iter__(self):
+        # A single pass over the map, with no need for the index.
+        data = self._map
+        start, size = 0, len(data)
+        while start < size:
+            end = data.find(b"\n", start)
+            if end == -1:
+                end = size
+            yield self._decode(start, end)
+            start = end + 1
+
+    def _decode(self, start, end):
+        try:
+            return self._map[start:end].decode(self._encoding).strip()
+        except UnicodeDecodeError as e:
+            raise _locate(e, self._map, start + e.start) from None
+
+
+def mmap_dictionary(path, encoding=None):
+    """
+    Create a sequence from a dictionary file, by memory-mapping it.
+
+    Take the same arguments as `dictionary()`.
+
+    Raise ValueError if the file cannot be mapped (e.g. it is empty), or
+    if its encoding does not represent a newline as a single byte; raise
+    OSError if it is not a regular file.
+
+    Return a sequence of the lines of the dictionary file, with
+    whitespace strip()ed.
+    """
+    return MappedDictionary(path, encoding)
+
+
+_LN2 = log(2)
+
+
+@lru_cache(maxsize=32)
+def selection_entropy(size, n):
+    """
+    Compute the entropy of a random selection.
+
+    Take:
+        size    the number of elements to select from
+        n       the number of elements to select
+
+    The selection is assumed ordered and without repetitions; its
+    entropy is then log2(size! / (size - n)!).
+
+    Return the entropy in bits.
+    """
+    return (lgamma(size + 1) - lgamma(size - n + 1)) / _LN2
 
 
 class Passphrase(list):
     """
     A passphrase builder.
+
+    Words are kept whole, as strings.
     """
 
+    __slots__ = ("_randbelow",)
+
     def __init__(self, words, randbelow=randbelow):
-        super().__init__(list(w) for w in words)
+        super().__init__(w if type(w) is str else "".join(w) for w in words)
         self._randbelow = randbelow
 
     @classmethod
-    def random(cls, dictionary, length, randbelow=randbelow):
+    def random(
+        cls,
+        dictionary,
+        length,
+        randbelow=randbelow,
+        compute_entropy=True,
+        transform=None,
+    ):
         """
         Generate a random passphrase.
 
         Take:
-            dictionary  an iterable of words
-            length      the passphrase length
+            dictionary      an iterable of words
+            length          the passphrase length
+            compute_entropy whether to compute the entropy (default: True)
+            transform       a function to apply to each selected word
+
+        If `dictionary` is a sequence, only the selected words are
+        accessed; other collections of known length (e.g. sets) are
+        listed first. Other iterables are selected from on-line (see
+        `select()`).
 
         Return a passphrase made of a random selection of words,
-        and its entropy.
+        and its entropy (None, unless `compute_entropy` is true).
         """
         if length <= 0:
             raise ValueError("passphrase length must be positive")
 
+        if isinstance(dictionary, Sized) and not isinstance(dictionary, Sequence):
+            dictionary = list(dictionary)
+
         try:
-            words, space = select(dictionary, length, randbelow)
+            if isinstance(dictionary, Sequence):
+                words, space = sample(dictionary, length, randbelow)
+            else:
+                words, space = select(dictionary, length, randbelow)
         except RuntimeError:
             raise RuntimeError("dictionary is too short")
-        entropy = sum(log2(n) for n in range(space, space - length, -1))
+        entropy = None
+        if compute_entropy:
+            entropy = selection_entropy(space, length)
+        if transform is not None:
+            words = map(transform, words)
         return Passphrase(words, randbelow), entropy
 
     def replace(self, i, replacement):
@@ -119,9 +454,9 @@ class Passphrase(list):
         Return self.
         """
         if callable(replacement):
-            self[i] = list(replacement("".join(self[i])))
+            self[i] = replacement(self[i])
         else:
-            self[i] = list(replacement)
+            self[i] = replacement
         return self
 
     def capitalize(self, i=0):
@@ -130,14 +465,18 @@ class Passphrase(list):
 
         Return self.
         """
-        return self.replace(i, str.title)
+        word = self[i]
+        for j, c in enumerate(word):
+            if c.lower() != c.upper():
+                self[i] = word[:j] + c.title() + word[j + 1 :]
+                break
+        return self
 
     def case_fold(self):
         """
         Down-case all letters.
         """
-        for i in range(len(self)):
-            self[i] = [c.lower() for c in self[i]]
+        self[:] = [w.lower() for w in self]
         return self
 
     def shorten_each(self, max_length):
@@ -151,8 +490,7 @@ class Passphrase(list):
 
         Return self.
         """
-        for i in range(len(self)):
-            self[i] = self[i][:max_length]
+        self[:] = [w[:max_length] for w in self]
         return self
 
     def randomize(self, charsets):
@@ -164,7 +502,9 @@ class Passphrase(list):
             charsets    an iterable of sequences of characters
 
         Honor charsets multiplicity; that is, swap a charset as many
-        times as it appears in `charsets`.
+        times as it appears in `charsets`. Positions are drawn uniformly
+        among all the characters of the passphrase; there must be at
+        least as many of them as (non-empty) charsets.
 
         This method can be used to satisfy rigid password policies,
         or to defeat dictionary attacks even in the case of short
@@ -172,19 +512,28 @@ class Passphrase(list):
 
         Return self.
         """
-        replacements = set()
-        for cs in charsets:
-            if not cs:
-                continue
-            c = cs[self._randbelow(len(cs))]
-            while True:
-                i = self._randbelow(len(self))
-                j = self._randbelow(len(self[i]))
-                if (i, j) not in replacements:
-                    break
-            self[i][j] = c
-            replacements.add((i, j))
-
+        charsets = [cs for cs in charsets if cs]
+        offsets = [0, *accumulate(map(len, self))]
+        randbelow, total = self._randbelow, offsets[-1]
+        if len(charsets) > total:
+            raise ValueError("too many characters to randomize")
+
+        # Draw the positions by a partial Fisher-Yates shuffle, recording
+        # only the slots it has displaced; and copy a word into an
+        # editable list only when a position lands on it.
+        displaced = {}
+        edited = {}
+        for t, cs in enumerate(charsets):
+            r = t + randbelow(total - t)
+            k = displaced.get(r, r)
+            displaced[r] = displaced.get(t, t)
+            i = bisect_right(offsets, k) - 1
+            if i not in edited:
+                edited[i] = list(self[i])
+            edited[i][k - offsets[i]] = cs[randbelow(len(cs))]
+
+        for i, chars in edited.items():
+            self[i] = "".join(chars)
         return self
 
     def translate(self, table):
@@ -195,8 +544,7 @@ class Passphrase(list):
 
         Return self.
         """
-        for i in range(len(self)):
-            self[i] = list("".join(self[i]).translate(table))
+        self[:] = [w.translate(table) for w in self]
         return self
 
     def join(self, separator=" "):
@@ -206,9 +554,9 @@ class Passphrase(list):
         Take:
             separator   a str-like object to separate words (default is space)
 
-        Return a byte-string.
+        Return a string.
         """
-        return separator.join("".join(w) for w in self)
+        return separator.join(self)
 
 
 def char_range(first, last):
@@ -226,18 +574,17 @@ def char_range(first, last):
 
 # Predefined charsets.
 CHARSETS_TAGS = {
-    "d": set(char_range("0", "9")),
-    "u": set(char_range("A", "Z")),
-    "l": set(char_range("a", "z")),
-    "s": set().union(
-        char_range("!", "/"),
-        char_range(":", "@"),
-        char_range("[", "`"),
-        char_range("{", "~"),
-    ),
+    "d": digits,
+    "u": ascii_uppercase,
+    "l": ascii_lowercase,
+    "s": punctuation,
 }
 
+# The predefined charsets, indexed by the code of their tag.
+_TAG_TABLE = tuple(CHARSETS_TAGS.get(chr(c)) for c in range(128))
+
 
+@lru_cache(maxsize=64)
 def parse_charset(expr):
     """
     Parse a charset expression.
@@ -291,12 +638,14 @@ def parse_charset(expr):
     left to right; falling back to matching a single `<character>` only if
     and when that should fail (and then reverting to matching ranges again).
 
-    Return the represented charset.
+    Return the represented charset, as a string of distinct characters.
     """
-    charset = set()
-
     if not expr:
-        return charset
+        return ""
+    if len(expr) == 1 and expr in CHARSETS_TAGS:
+        return CHARSETS_TAGS[expr]
+
+    charset = []
 
     if expr[0] == "[":
         # Parse an enumeration.
@@ -305,27 +654,37 @@ def parse_charset(expr):
         except ValueError:
             raise ValueError("bad charset specification: %s" % expr)
 
-        if rest:
-            charset.update(parse_charset(rest))
-
-        for sub in findall(r"[^-]-[^-]|.", spec):
-            if len(sub) == 1:
-                charset.add(sub)
+        # Match ranges left to right, falling back to single characters.
+        i, n = 0, len(spec)
+        while i < n:
+            if (
+                i + 2 < n
+                and spec[i + 1] == "-"
+                and spec[i] != "-"
+                and spec[i + 2] != "-"
+            ):
+                first, last = ord(spec[i]), ord(spec[i + 2])
+                charset.append("".join(map(chr, range(first, last + 1))))
+                i += 3
             else:
-                charset.update(char_range(*sub.split("-")))
+                charset.append(spec[i])
+                i += 1
 
-        return charset
+        if rest:
+            charset.append(parse_charset(rest))
 
-    # Parse a union.
-    for i, tag in enumerate(expr):
-        if tag == "[":
-            return charset.union(parse_charset(expr[i:]))
-        try:
-            charset.update(CHARSETS_TAGS[tag])
-        except KeyError as e:
-            raise ValueError("unknown charset tag: %s" % e.args)
+    else:
+        # Parse a union.
+        for i, tag in enumerate(expr):
+            if tag == "[":
+                charset.append(parse_charset(expr[i:]))
+                break
+            cs = _TAG_TABLE[ord(tag)] if tag < "\x80" else None
+            if cs is None:
+                raise ValueError("unknown charset tag: %s" % tag)
+            charset.append(cs)
 
-    return charset
+    return "".join(dict.fromkeys("".join(charset)))
 
 
 def main():
@@ -360,12 +719,12 @@ def main():
         print("Error: %s" % msg, file=stderr)
         return exit_status
 
-    source = dictionary("/usr/share/dict/words", "UTF-8")
+    path, encoding = "/usr/share/dict/words", "UTF-8"
     capitalize = False
     case_fold = False
     randomize = []
     least_entropy = 0
-    translate = {}
+    translate = None
     separator = " "
     max_word_length = False
 
@@ -388,80 +747,115 @@ def main():
     except GetoptError as err:
         return error(err, 2)
 
+    def set_file(flag, arg):
+        nonlocal path, encoding
+        path, encoding = arg, None
+
+    def set_capitalize(flag, arg):
+        nonlocal capitalize
+        capitalize = True
+
+    def set_case_fold(flag, arg):
+        nonlocal case_fold
+        case_fold = True
+
+    def set_word_length(flag, arg):
+        nonlocal max_word_length
+        try:
+            max_word_length = int(arg)
+        except ValueError:
+            return error("%s: not a length: %s" % (flag, arg))
+        if max_word_length <= 0:
+            return error("%s: illegal maximum word length: %s <= 0" % (flag, arg))
+
+    def add_randomize(flag, arg):
+        try:
+            cs = parse_charset(arg)
+        except ValueError as e:
+            return error("%s: %s" % (flag, *e.args))
+        randomize.append(cs)
+
+    def set_separator(flag, arg):
+        nonlocal separator
+        separator = arg
+
+    def add_translate(flag, arg):
+        nonlocal translate
+        xs, colon, ys = arg.partition(":")
+        if not colon:
+            return error("%s: expected <xs>:<ys>: %s" % (flag, arg))
+        if len(xs) < len(ys):
+            return error("%s: characters in <ys> outnumber <xs>" % flag)
+        if translate is None:
+            translate = {}
+        translate.update(str.maketrans(xs[: len(ys)], ys, xs[len(ys) :]))
+
+    def set_least_entropy(flag, arg):
+        nonlocal least_entropy
+        try:
+            least_entropy = float(arg)
+        except ValueError:
+            return error("%s: bad entropy value: %s" % (flag, arg))
+
+    handlers = {}
+    for flags, handler in (
+        (("-h", "--help"), lambda flag, arg: usage()),
+        (("-f", "--file"), set_file),
+        (("-C", "--capitalize"), set_capitalize),
+        (("-F", "--case-fold"), set_case_fold),
+        (("-W", "--word-length"), set_word_length),
+        (("-R", "--randomize"), add_randomize),
+        (("-s", "--separator"), set_separator),
+        (("-T", "--translate"), add_translate),
+        (("-E", "--least-entropy"), set_least_entropy),
+    ):
+        handlers.update(dict.fromkeys(flags, handler))
+
+    # Handlers return an exit status to stop at.
     for flag, arg in options:
-        if flag in ("-h", "--help"):
-            return usage()
-
-        if flag in ("-f", "--file"):
-            source = dictionary(arg)
-
-        elif flag in ("-C", "--capitalize"):
-            capitalize = True
-
-        elif flag in ("-F", "--case-fold"):
-            case_fold = True
-
-        elif flag in ("-W", "--word-length"):
-            try:
-                max_word_length = int(arg)
-            except ValueError:
-                return error("%s: not a length: %s" % (flag, arg))
-            if max_word_length <= 0:
-                return error("%s: illegal maximum word length: %s <= 0" % (flag, arg))
-
-        elif flag in ("-R", "--randomize"):
-            try:
-                cs = parse_charset(arg)
-            except ValueError as e:
-                return error("%s: %s" % (flag, *e.args))
-            randomize.append(tuple(cs))
-
-        elif flag in ("-s", "--separator"):
-            separator = arg
-
-        elif flag in ("-T", "--translate"):
-            xs, ys = arg.split(":", 1)
-            if len(xs) < len(ys):
-                return error("%s: characters in <ys> outnumber <xs>" % flag)
-            for x, y in zip(xs, ys):
-                translate[ord(x)] = y
-            for x in xs[len(ys):]:
-                translate[ord(x)] = None
-
-        elif flag in ("-E", "--least-entropy"):
-            try:
-                least_entropy = float(arg)
-            except ValueError:
-                return error("%s: bad entropy value: %s" % (flag, arg))
+        status = handlers[flag](flag, arg)
+        if status is not None:
+            return status
 
     if len(positionals) != 1:
         return usage()
     try:
         length = int(positionals[0])
     except ValueError:
-        return error("invalid length: %s" % v)
+        return error("invalid length: %s" % positionals[0])
     if length < 1:
         return error("length must be positive")
 
     try:
-        pp, entropy = Passphrase.random(source, length)
-    except RuntimeError as e:
+        source = dictionary(path, encoding)
+        pp, entropy = Passphrase.random(
+            source,
+            length,
+            RandPool(),
+            compute_entropy=least_entropy > 0,
+            transform=(lambda w: w[:max_word_length]) if max_word_length else None,
+        )
+    except UnicodeDecodeError as e:
+        return error("%s: %s" % (path, e))
+    except (OSError, RuntimeError) as e:
         return error(e)
 
-    if entropy < least_entropy:
+    if entropy is not None and entropy < least_entropy:
         return error(
             "insufficient entropy (%f < %f): "
             "generate a longer passphrase or use a bigger dictionary"
             % (entropy, least_entropy)
         )
 
-    if max_word_length:
-        pp.shorten_each(max_word_length)
     if case_fold:
         pp.case_fold()
-    pp.translate(translate)
+    if translate is not None:
+        pp.translate(translate)
     if randomize:
-        pp.randomize(randomize)
+        try:
+            pp.randomize(randomize)
+        except ValueError as e:
+            return error(e)
     if capitalize:
         pp.capitalize()
 